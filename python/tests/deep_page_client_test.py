@@ -1,6 +1,8 @@
 
-from elastic_transport import Transport
-from elastic_transport.client_utils import url_to_node_config
+import json
+import bisect
+from contextlib import ExitStack
+from unittest.mock import patch
 from es_deep_pager.deep_page_client import DeepPageClient
 
 
@@ -13,8 +15,7 @@ def build_deep_page_client():
     password = "search"
 
     node_urls = [ f"{schame}://{username}:{password}@{host}" for host in hosts.split(",") ]
-    nodes = [ url_to_node_config(url) for url in node_urls ]
-    transport = Transport(nodes)
+    transport = DeepPageClient.build_transport(node_urls, maxsize=100)
     return transport
 
 
@@ -32,3 +33,114 @@ def test_deep_page_client():
         10000)
     print(response)
 
+
+
+def count_sorted_ids(ids):
+    """ Build a replacement of the countAPI call, counting the sorted ids in the range of the query. """
+    def count(self, index, query_json, preference):
+        query = json.loads(query_json)
+        if "bool" not in query:
+            return len(ids)
+        (bounds,) = query["bool"]["filter"][1]["range"].values()
+        return bisect.bisect_right(ids, bounds["lte"]) - bisect.bisect_left(ids, bounds["gte"])
+    return count
+
+
+def assert_new_from(ids, sort_start, sort_end, s_from, end_count):
+    """ Call __find_new_from with counts of the sorted ids, and check the result skips exactly s_from documents. """
+    client = DeepPageClient(None)
+    direction = DeepPageClient._DeepPageClient__directions[sort_start <= sort_end]
+    with patch.object(DeepPageClient, "_DeepPageClient__count", count_sorted_ids(ids)):
+        (new_start, new_from) = client._DeepPageClient__find_new_from(
+            "test_data", {"match_all": {}}, "id", direction, sort_start, sort_end, s_from, end_count, "test", {})
+
+    if sort_start <= sort_end:
+        skipped = bisect.bisect_right(ids, new_start) - bisect.bisect_left(ids, sort_start)
+    else:
+        skipped = bisect.bisect_right(ids, sort_start) - bisect.bisect_left(ids, new_start + 1)
+    assert skipped + new_from == s_from
+    return new_from
+
+
+def test_find_new_from():
+    """ Test the from value found by __find_new_from. """
+    ids = [ i * i - 50000000 for i in range(20000) ]
+    for s_from in [ 2001, 5000, 12345, 19999 ]:
+        assert 0 <= assert_new_from(ids, ids[0], ids[-1], s_from, len(ids)) <= 2000
+        assert 0 <= assert_new_from(ids, ids[0], ids[-1], s_from, None) <= 2000
+        assert 0 <= assert_new_from(ids, ids[-1], ids[0], s_from, len(ids)) <= 2000
+
+
+def test_find_new_from_end():
+    """ Test __find_new_from when the from value is beyond the documents, so the search stops at adjacent sort values. """
+    ids = list(range(0, 30000, 3))
+    assert 2000 <= assert_new_from(ids, ids[0], ids[-1], 12000, len(ids)) <= 2001
+    assert 2000 <= assert_new_from(ids, ids[-1], ids[0], 12000, len(ids)) <= 2001
+
+
+def test_search_iter_validation():
+    """ Test search_iter reports invalid parameters when it is called, not when it is iterated. """
+    client = DeepPageClient(None)
+    for args in [ ("", None, None, "id", True, 0, 5), ("test_data", None, None, "", True, 0, 5), ("test_data", None, None, "id", True, -1, 5) ]:
+        try:
+            client.search_iter(*args)
+        except Exception:
+            continue
+        assert False, f"search_iter{args} did not raise"
+
+
+def search_sorted_ids(ids, query, asc, after_value, s_from, s_size, violations):
+    """ Search the sorted ids like elasticsearch, hits are sorted by id and have only the id in the source. """
+    hits = ids if asc else ids[::-1]
+    if "bool" in query:
+        (bounds,) = query["bool"]["filter"][1]["range"].values()
+        ((cmp, value),) = bounds.items()
+        hits = [ i for i in hits if (i > value if cmp == "gt" else i < value) ]
+    if after_value is not None:
+        hits = [ i for i in hits if (i > after_value if asc else i < after_value) ]
+    # Elasticsearch rejects a from and size beyond the default max_result_window of the index.
+    if s_from + s_size > 10000:
+        violations.append((s_from, s_size))
+    return [ {"_source": {"id": i}, "sort": [i]} for i in hits[s_from:s_from + s_size] ]
+
+
+def patch_sorted_ids(ids, violations):
+    """ Replace all elasticsearch calls of DeepPageClient with searches and counts of the sorted ids. """
+    def query(self, index, query, source_json, sort, direction, s_from, s_size, preference):
+        return search_sorted_ids(ids, query, direction.asc, None, s_from, s_size, violations)
+
+    def query_after(self, index, after_prefix, after_value, s_size, preference):
+        body = json.loads(f"{after_prefix}{after_value}],\"size\":{s_size}}}")
+        ((_, order),) = body["sort"][0].items()
+        return search_sorted_ids(ids, body["query"], order == "asc", after_value, 0, s_size, violations)
+
+    def msearch(self, index, bodies, preference):
+        result = []
+        for body in map(json.loads, bodies):
+            ((_, order),) = body["sort"].items()
+            result.append(search_sorted_ids(ids, body["query"], order == "asc", None, body["from"], body["size"], violations))
+        return result
+
+    patches = ExitStack()
+    patches.enter_context(patch.object(DeepPageClient, "_DeepPageClient__count", count_sorted_ids(ids)))
+    patches.enter_context(patch.object(DeepPageClient, "_DeepPageClient__query", query))
+    patches.enter_context(patch.object(DeepPageClient, "_DeepPageClient__query_after", query_after))
+    patches.enter_context(patch.object(DeepPageClient, "_DeepPageClient__msearch", msearch))
+    return patches
+
+
+def test_search_parallel():
+    """ Test searching with parallel batches, in both directions, near both ends, and beyond the end of the documents. """
+    ids = [ i * i - 50000000 for i in range(20000) ]
+    client = DeepPageClient(None, max_workers=4)
+    violations = []
+    with patch_sorted_ids(ids, violations):
+        for asc in [ True, False ]:
+            expected_ids = ids if asc else ids[::-1]
+            for (s_from, s_size) in [ (0, 20000), (2500, 9001), (5000, 50000), (11000, 20000), (12000, 30000), (13000, 6500), (19000, 5000) ]:
+                expected = expected_ids[s_from:s_from + s_size]
+                result = client.search("test_data", None, None, "id", asc, s_from, s_size)
+                assert [ hit["_source"]["id"] for hit in result ] == expected
+                result = client.search_iter("test_data", None, None, "id", asc, s_from, s_size)
+                assert [ hit["_source"]["id"] for hit in result ] == expected
+    assert violations == []